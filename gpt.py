@@ -3,43 +3,294 @@ GPT модуль для обработки текстовых запросов 
 
 Модуль предоставляет функционал для:
 - Обработки текстовых запросов через OpenAI GPT API
-- Хранения истории диалогов в CSV файле
-- Загрузки пользовательских ролей из текстового файла
+- Хранения последних сообщений в памяти и истории диалогов в базе SQLite
+- Загрузки пользовательской роли из текстового файла при импорте
 
 Требования:
 - OpenAI API ключ
-- pandas для работы с CSV
-- openai библиотека
+- openai библиотека версии 1.x и httpx
 
 Автор: Шабалин Игорь
 Версия: 1.0
 """
 
-import datetime
+import atexit
+import csv
+import hashlib
 import os
-import codecs
-import pandas as pd
-import openai
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+import httpx
+from openai import OpenAI
 
 # Конфигурационные параметры
 HISTORY_LENGTH = 8  # Количество последних сообщений для контекста
 TEMPERATURE = 0.7   # Параметр температуры для GPT (0-1). Чем выше, тем более креативные ответы
-HISTORY_FILE = 'history1.csv'  # Файл для хранения истории диалогов
+HISTORY_DB = 'history.db'  # База SQLite для хранения истории диалогов
+HISTORY_FILE = 'history1.csv'  # Старый CSV файл истории, переносится в базу однократно
+HISTORY_FLUSH_TURNS = 10  # Через сколько обменов накопленная история пишется в базу
 MODEL = "gpt-4o"    # Используемая модель GPT
+PROXY = 'http://123.123.123.123:3128'  # Прокси для OpenAI API (None - без прокси)
+CACHE_TTL = 1800    # Время жизни ответа в кэше (сек)
+CACHE_MAX_SIZE = 256  # Максимальное количество ответов в кэше
+CACHE_MIN_WORDS = 2  # Более короткие реплики ("да", "почему?") считаются уточнениями и не кэшируются
+# Слова, с которых начинаются уточнения к предыдущему ответу; такие реплики не кэшируются
+FOLLOWUP_WORDS = {'а', 'и', 'но', 'да', 'нет', 'почему', 'зачем', 'еще', 'ещё', 'тогда', 'это', 'он', 'она', 'они'}
 
-# Настройка прокси если необходимо
-openai.proxy = {
-    'http': 'http://123.123.123.123:3128',
-    'https': 'http://123.123.123.123:3128'
-}
+# Клиент OpenAI создается один раз и переиспользует HTTP соединения
+_client = OpenAI(
+    api_key=os.environ.get('OPENAI_API_KEY', 'your-api-key-here'),  # Замените на ваш ключ API
+    http_client=httpx.Client(proxy=PROXY) if PROXY else None
+)
+
+# Файл роли читается один раз при импорте модуля
+with open(os.path.join(os.getcwd(), 'role.txt'), encoding='utf-8') as file:
+    ROLE = file.read()
+
+# Подключение к базе истории диалогов, общее для всех вызовов ask()
+conn = sqlite3.connect(HISTORY_DB, check_same_thread=False)
+conn.execute(
+    'CREATE TABLE IF NOT EXISTS history ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'user_id INT, '
+    'role TEXT, '
+    'content TEXT)'
+)
+conn.execute('CREATE INDEX IF NOT EXISTS idx_user ON history(user_id)')
+conn.commit()
+
+def _import_csv_history():
+    """
+    Перенос истории из CSV файла прежних версий в пустую базу.
+    
+    Файл читается построчно через csv.reader и вставляется одной
+    транзакцией, не загружая его целиком в память.
+    """
+    if not os.path.exists(HISTORY_FILE):
+        return
+    if conn.execute('SELECT 1 FROM history LIMIT 1').fetchone():
+        return
+    
+    with open(HISTORY_FILE, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Заголовок: user_id, role, content
+        with conn:
+            conn.executemany(
+                'INSERT INTO history (user_id, role, content) VALUES (?, ?, ?)',
+                (row for row in reader if len(row) == 3)
+            )
+    print(f"История перенесена из {HISTORY_FILE} в {HISTORY_DB}")
+
+_import_csv_history()
+
+# Граница предложения: пробел после точки, восклицательного или вопросительного знака
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# Кэш ответов: ключ запроса -> (ответ, время сохранения)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()  # Кэш используют потоки ответов и упреждающих запросов
+
+def _cache_key(user_id: int, text: str):
+    """
+    Ключ кэша для запроса пользователя.
+    
+    Кэшируются только самостоятельные команды и вопросы ("как дела?",
+    "выключи свет"): их ответ не зависит от предыдущих реплик, поэтому
+    ключ строится без истории. Для уточнений ("почему?", "а ещё?", "да")
+    ключ не создается, и они всегда уходят в GPT с контекстом.
+    
+    Returns:
+        str: Ключ кэша или None, если запрос не кэшируется
+    """
+    words = re.findall(r'\w+', text.casefold())
+    if len(words) < CACHE_MIN_WORDS or words[0] in FOLLOWUP_WORDS:
+        return None
+    return hashlib.sha256(
+        f"{user_id}|{ROLE}|{' '.join(words)}".encode('utf-8')
+    ).hexdigest()
+
+def _cache_get(key):
+    """Возвращает сохраненный ответ или None, если его нет или он устарел."""
+    if key is None:
+        return None
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        response_text, saved_at = entry
+        if time.time() - saved_at > CACHE_TTL:
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return response_text
+
+def _cache_put(key, response_text: str, keep_existing: bool = False):
+    """
+    Сохраняет ответ в кэш, вытесняя самые старые записи.
+    
+    Args:
+        key: Ключ из _cache_key (None - не сохранять)
+        response_text (str): Ответ от GPT модели
+        keep_existing (bool): Не обновлять уже сохраненный ответ и его время
+    """
+    if key is None:
+        return
+    with _cache_lock:
+        if keep_existing and key in _cache:
+            return
+        _cache[key] = (response_text, time.time())
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_SIZE:
+            _cache.popitem(last=False)
+
+# Последние сообщения каждого пользователя: user_id -> deque({'role', 'content'})
+_history = {}
+# Сообщения, еще не записанные в базу: (user_id, role, content)
+_pending_rows = []
+_history_lock = threading.RLock()
+_flush_lock = threading.Lock()  # Записи в базу выполняются по одной
+
+def _user_history(user_id: int) -> deque:
+    """
+    Кольцевой буфер последних сообщений пользователя.
+    
+    При первом обращении заполняется из базы, дальше обновляется
+    только в памяти.
+    """
+    with _history_lock:
+        history = _history.get(user_id)
+        if history is None:
+            rows = conn.execute(
+                'SELECT role, content FROM history WHERE user_id = ? '
+                'ORDER BY id DESC LIMIT ?',
+                (user_id, HISTORY_LENGTH - 1)
+            ).fetchall()
+            history = deque(
+                ({'role': role, 'content': content} for role, content in reversed(rows)),
+                maxlen=HISTORY_LENGTH - 1
+            )
+            _history[user_id] = history
+        return history
+
+def flush_history():
+    """Запись накопленных сообщений в базу одной транзакцией."""
+    with _flush_lock:
+        with _history_lock:
+            rows = _pending_rows[:]
+        if not rows:
+            return
+        with conn:
+            conn.executemany(
+                'INSERT INTO history (user_id, role, content) VALUES (?, ?, ?)',
+                rows
+            )
+        
+        # Удаляем только записанные строки: при ошибке они останутся
+        # для следующей попытки, а добавленные за время записи сохранятся
+        with _history_lock:
+            del _pending_rows[:len(rows)]
+
+atexit.register(flush_history)
+
+def _save_history(user_id: int, text: str, response_text: str):
+    """Добавление запроса и ответа в историю с периодической записью в базу."""
+    history = _user_history(user_id)
+    with _history_lock:
+        history.append({'role': 'user', 'content': text})
+        history.append({'role': 'assistant', 'content': response_text})
+        _pending_rows.append((user_id, 'user', text))
+        _pending_rows.append((user_id, 'assistant', response_text))
+        flush = len(_pending_rows) >= HISTORY_FLUSH_TURNS * 2
+    if flush:
+        try:
+            flush_history()
+        except sqlite3.Error as err:
+            print(f"Ошибка записи истории, повтор при следующей записи: {err}")
+
+def split_sentences(text: str) -> list:
+    """Разбивает текст на предложения для поочередного синтеза речи."""
+    return [sentence for sentence in SENTENCE_END.split(text.strip()) if sentence]
+
+def _build_messages(user_id: int, text: str) -> list:
+    """
+    Формирование сообщений для GPT с учетом истории пользователя.
+    
+    Args:
+        user_id (int): Идентификатор пользователя
+        text (str): Текст запроса
+    
+    Returns:
+        list: Сообщения для OpenAI Chat Completions
+    """
+    # Последние сообщения пользователя и новое сообщение
+    with _history_lock:
+        history = list(_user_history(user_id))
+    history.append({'role': 'user', 'content': text})
+    
+    # Неизменная системная роль идет первой, чтобы OpenAI мог
+    # переиспользовать закэшированный префикс запроса
+    return [
+        {
+            'role': 'system',
+            'content': ROLE
+        }
+    ] + history
+
+def draft(user_id: int, text: str) -> str:
+    """
+    Получение ответа GPT без сохранения в историю.
+    
+    Используется для упреждающих запросов по промежуточному тексту
+    распознавания: если итоговый текст совпадет, ответ фиксируется
+    через remember(), иначе просто отбрасывается.
+    
+    Args:
+        user_id (int): Идентификатор пользователя
+        text (str): Текст запроса
+    
+    Returns:
+        str: Ответ от GPT модели
+    """
+    # Повторный запрос обслуживается из кэша без обращения к API.
+    # При TEMPERATURE > 0 это сознательное переиспользование ответа.
+    cached = _cache_get(_cache_key(user_id, text))
+    if cached is not None:
+        print("Ответ найден в кэше")
+        return cached
+    
+    # Запрос к GPT API
+    response = _client.chat.completions.create(
+        model=MODEL,
+        messages=_build_messages(user_id, text),
+        temperature=TEMPERATURE,
+        user=str(user_id)
+    )
+    
+    return response.choices[0].message.content
+
+def remember(user_id: int, text: str, response_text: str):
+    """
+    Сохранение запроса и ответа в историю и кэш.
+    
+    Args:
+        user_id (int): Идентификатор пользователя
+        text (str): Текст запроса
+        response_text (str): Ответ от GPT модели
+    """
+    _save_history(user_id, text, response_text)
+    _cache_put(_cache_key(user_id, text), response_text, keep_existing=True)
 
 def ask(user_id: int, text: str) -> str:
     """
     Обработка текстового запроса через GPT API.
     
     Функция выполняет следующие шаги:
-    1. Загружает историю диалогов из CSV файла
-    2. Читает файл роли для контекста
+    0. Возвращает ответ из кэша, если такой запрос уже был недавно
+    1. Берет последние сообщения пользователя из памяти
+    2. Использует загруженную при импорте роль для контекста
     3. Формирует запрос к GPT с учетом истории
     4. Сохраняет ответ в историю
     
@@ -55,69 +306,81 @@ def ask(user_id: int, text: str) -> str:
     """
     print("Обработка запроса")
     
-    # Установка API ключа
-    gpt_key = 'your-api-key-here'  # Замените на ваш ключ API
-    openai.api_key = gpt_key
+    response_text = draft(user_id, text)
+    remember(user_id, text, response_text)
     
-    # Загрузка истории диалогов
-    try:
-        history = pd.read_csv(HISTORY_FILE)
-    except OSError:
-        history = pd.DataFrame(columns=['user_id', 'role', 'content'])
-    
-    # Чтение файла роли
-    role_file = os.path.join(os.getcwd(), 'role.txt')
-    with codecs.open(role_file, 'r', encoding='utf-8') as file:
-        role = file.read()
-    
-    started = datetime.datetime.now()
-    
-    # Добавление нового сообщения в историю
-    history = pd.concat(
-        [history, pd.DataFrame.from_records([{
-            'user_id': user_id,
-            'role': 'user',
-            'content': text
-        }])],
-        ignore_index=True
-    )
+    return response_text
+
+def ask_stream(user_id: int, text: str):
+    """
+    Потоковая обработка текстового запроса через GPT API.
     
-    # Формирование сообщений для GPT
-    messages = [
-        {
-            'role': 'system',
-            'content': role,
-            'temperature': TEMPERATURE
-        },
-        {
-            'role': 'user',
-            'content': ''
-        }
-    ] + history[history['user_id'] == user_id][['role', 'content']].tail(
-        HISTORY_LENGTH
-    ).to_dict('records')
+    В отличие от ask() ответ запрашивается с stream=True и отдается
+    по предложениям по мере генерации, чтобы синтез речи мог начаться
+    до получения полного ответа. История и кэш обновляются после
+    получения последнего фрагмента.
     
-    # Запрос к GPT API
-    response = openai.ChatCompletion.create(
-        model=MODEL,
-        messages=messages
-    )
+    Если генератор закрыт досрочно (ответ прерван пользователем),
+    HTTP поток закрывается сразу, а в историю записываются вопрос
+    и уже полученная часть ответа; в кэш такой ответ не попадает.
     
-    # Сохранение ответа в историю
-    response_text = response['choices'][0]['message']['content']
-    history = pd.concat(
-        [history, pd.DataFrame.from_records([{
-            'user_id': user_id,
-            'role': 'assistant',
-            'content': response_text
-        }])],
-        ignore_index=True
+    Args:
+        user_id (int): Идентификатор пользователя
+        text (str): Текст запроса
+    
+    Yields:
+        str: Очередное законченное предложение ответа
+    
+    Raises:
+        Exception: При ошибках работы с API или файлами
+    """
+    print("Обработка запроса")
+    
+    key = _cache_key(user_id, text)
+    cached = _cache_get(key)
+    if cached is not None:
+        print("Ответ найден в кэше")
+        _save_history(user_id, text, cached)
+        yield from split_sentences(cached)
+        return
+    
+    # Потоковый запрос к GPT API
+    response = _client.chat.completions.create(
+        model=MODEL,
+        messages=_build_messages(user_id, text),
+        temperature=TEMPERATURE,
+        user=str(user_id),
+        stream=True
     )
     
-    # Сохранение обновленной истории
-    history.to_csv(HISTORY_FILE, index=False)
+    parts = []
+    buffer = ''
+    try:
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            parts.append(content)
+            buffer += content
+            
+            # Все фрагменты, кроме последнего, уже законченные предложения
+            *sentences, buffer = SENTENCE_END.split(buffer)
+            for sentence in sentences:
+                if sentence:
+                    yield sentence
+        
+        if buffer.strip():
+            yield buffer.strip()
+    finally:
+        # Соединение возвращается в пул и при досрочном закрытии генератора
+        response.close()
+        response_text = ''.join(parts)
+        if response_text:
+            _save_history(user_id, text, response_text)
     
-    return response_text
+    _cache_put(key, response_text)
 
 if __name__ == "__main__":
     # Пример использования
@@ -6,17 +6,18 @@
 
 Модуль обеспечивает:
 - Захват аудио с USB микрофона
+- Отсев тишины перед распознаванием (WebRTC VAD)
 - Распознавание речи через Google Speech Recognition
 - Генерацию ответов через GPT
 - Синтез речи через Google Text-to-Speech
-- Воспроизведение аудио через ALSA
+- Воспроизведение аудио через ALSA (aplay)
 
 Требования:
 - Python 3.7+
 - USB аудио устройство
 - Google Cloud credentials (файл ваш файл.json)
 - Установленные библиотеки: google-cloud-speech, google-cloud-texttospeech,
-  pyaudio, pygame, alsaaudio
+  pyaudio, alsaaudio, webrtcvad; утилита aplay (alsa-utils)
 
 Автор: Шабалин Игорь
 Лицензия: MIT
@@ -24,33 +25,84 @@
 """
 
 from __future__ import division
+import collections
+import io
 import re
+import signal
+import subprocess
 import sys
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import speech
 from google.cloud import texttospeech
 import pyaudio
 from six.moves import queue
 import os
-import pygame
 import time
-from gpt import ask
+from gpt import ask_stream, draft, remember, split_sentences
 import warnings
 import alsaaudio
+import webrtcvad
 
 # Конфигурационные параметры
-RATE = 44100  # Частота дискретизации (Hz)
+RATE = 16000  # Частота дискретизации для распознавания (Hz)
+MIC_RATE = 16000  # Частота, поддерживаемая микрофоном; при отличии от RATE звук пересчитывается
 CHUNK = int(RATE / 10)  # Размер чанка (100ms)
+MIC_BUFFER_CHUNKS = 2  # Размер буфера PyAudio в чанках, запас на случай задержек Python
+MIC_NICE = -5  # Приоритет процесса для захвата звука (ниже - выше приоритет)
+MIC_NAME = "USB"  # Часть названия устройства записи, по которой ищется микрофон
 MIN_TEXT_LENGTH = 3  # Минимальная длина текста для обработки
 PAUSE_TIME = 1.5  # Минимальная пауза между обработками (сек)
+PREFETCH_STABLE_FRAMES = 2  # Сколько раз подряд должен повториться промежуточный текст для упреждающего запроса
+VAD_MODE = 2  # Агрессивность детектора речи (0-3)
+VAD_FRAME_MS = 20  # Длина кадра для детектора речи (10, 20 или 30 мс)
+VAD_HANGOVER_FRAMES = 50  # Кадры после окончания речи, которые еще отправляются (1с, чтобы распознавание зафиксировало конец фразы)
+VAD_PREROLL_FRAMES = 10  # Кадры перед началом речи, которые отправляются вместе с ней (200ms)
+VAD_KEEPALIVE = 5  # Интервал отправки тишины, чтобы Google не закрыл поток (сек)
 LANGUAGE_CODE = "ru-RU"  # Язык распознавания
 CREDENTIALS_FILE = "ваш файл.json"  # Файл с учетными данными Google Cloud
-OUTPUT_FILE = "output.mp3"  # Файл для временного хранения аудио
+TTS_WORKERS = 2  # Количество одновременных запросов синтеза речи
+TTS_SAMPLE_RATE = 24000  # Частота синтезированной речи и воспроизведения (Hz)
+APLAY_BUFFER_TIME = 0.2  # Размер буфера ALSA в aplay (сек)
+APLAY_PERIOD_TIME = 0.05  # Размер периода ALSA в aplay (сек)
+APLAY_COMMAND = [
+    'aplay', '-q', '-r', str(TTS_SAMPLE_RATE), '-c', '1', '-f', 'S16_LE',
+    f'--buffer-time={int(APLAY_BUFFER_TIME * 1000000)}',
+    f'--period-time={int(APLAY_PERIOD_TIME * 1000000)}'
+]
+GREETING_FILE = "what_do_you_want.wav"  # Приветственное сообщение
+
+# Команды завершения работы
+_EXIT_RE = re.compile(r"\b(exit|quit|стоп|выход)\b", re.I)
 
 # Настройка окружения
 warnings.filterwarnings("ignore", category=RuntimeWarning)  # Игнорируем предупреждения ALSA
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"  # Скрываем приветствие pygame
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(os.getcwd(), CREDENTIALS_FILE)
 
+# Клиенты Google Cloud создаются один раз и переиспользуются между вызовами
+_SPEECH_CLIENT = speech.SpeechClient()
+_TTS_CLIENT = texttospeech.TextToSpeechClient()
+_VOICE = texttospeech.VoiceSelectionParams(
+    language_code=LANGUAGE_CODE,
+    name='ru-RU-Wavenet-D',
+    ssml_gender=texttospeech.SsmlVoiceGender.MALE
+)
+_AUDIO_CFG = texttospeech.AudioConfig(
+    audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+    sample_rate_hertz=TTS_SAMPLE_RATE
+)
+
+# Пул потоков для синтеза речи по предложениям
+_TTS_EXECUTOR = ThreadPoolExecutor(max_workers=TTS_WORKERS)
+
+# Ответы обрабатываются по одному в фоне, чтобы не останавливать распознавание
+_RESPONSE_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+_BARGE_IN = threading.Event()  # Пользователь перебил текущий ответ
+
+# Упреждающие запросы к GPT по устоявшемуся промежуточному тексту
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
 class MicrophoneStream:
     """
     Класс для потоковой записи аудио с микрофона.
@@ -59,17 +111,27 @@ class MicrophoneStream:
     Поддерживает работу с USB аудио устройствами через PyAudio.
     """
     
-    def __init__(self, rate: int, chunk: int):
+    def __init__(self, rate: int, chunk: int, device_rate: int = None):
         """
         Инициализация параметров аудиопотока.
         
         Args:
             rate (int): Частота дискретизации
             chunk (int): Размер буфера
+            device_rate (int): Частота микрофона, если он не поддерживает rate
         """
         self._rate = rate
         self._chunk = chunk
-        self._buff = queue.Queue()
+        self._device_rate = device_rate or rate
+        self._ratecv_state = None  # Состояние пересчета частоты между чанками
+        self._vad = webrtcvad.Vad(VAD_MODE)
+        self._vad_frame_bytes = rate * VAD_FRAME_MS // 1000 * 2  # 16 бит моно
+        self._vad_rest = b""  # Неполный кадр, оставшийся от прошлого чанка
+        self._preroll = collections.deque(maxlen=VAD_PREROLL_FRAMES)
+        self._hangover = 0
+        self._last_sent = time.time()
+        self._buff = collections.deque()
+        self._event = threading.Event()  # Сигнал о поступлении новых данных
         self.closed = True
         
     def __enter__(self):
@@ -79,18 +141,21 @@ class MicrophoneStream:
         """
         self._audio_interface = pyaudio.PyAudio()
         
-        # Вывод информации о доступных устройствах
+        # Вывод информации о доступных устройствах (только при DEBUG_AUDIO)
         self._print_audio_devices()
+        device_index = self._find_input_device()
         
         try:
             self._audio_stream = self._audio_interface.open(
                 format=pyaudio.paInt16,
                 channels=1,
-                rate=self._rate,
+                rate=self._device_rate,
                 input=True,
-                frames_per_buffer=self._chunk,
+                frames_per_buffer=(
+                    self._chunk * MIC_BUFFER_CHUNKS * self._device_rate // self._rate
+                ),
                 stream_callback=self._fill_buffer,
-                input_device_index=1  # USB микрофон
+                input_device_index=device_index  # USB микрофон
             )
             print("Аудио поток успешно открыт")
         except Exception as e:
@@ -100,8 +165,26 @@ class MicrophoneStream:
         self.closed = False
         return self
 
+    def _find_input_device(self):
+        """
+        Поиск микрофона по названию устройства.
+        
+        Returns:
+            int: Индекс первого устройства записи, в названии которого есть
+            MIC_NAME, или None для устройства по умолчанию
+        """
+        for i in range(self._audio_interface.get_device_count()):
+            dev_info = self._audio_interface.get_device_info_by_index(i)
+            if dev_info['maxInputChannels'] > 0 and MIC_NAME in dev_info['name']:
+                print(f"Микрофон: {dev_info['name']} (Device {i})")
+                return i
+        print(f"Микрофон '{MIC_NAME}' не найден, используется устройство по умолчанию")
+        return None
+
     def _print_audio_devices(self):
-        """Вывод информации о доступных аудио устройствах."""
+        """Вывод информации о доступных аудио устройствах (при заданной DEBUG_AUDIO)."""
+        if not os.environ.get('DEBUG_AUDIO'):
+            return
         print("\nДоступные аудио устройства:")
         for i in range(self._audio_interface.get_device_count()):
             dev_info = self._audio_interface.get_device_info_by_index(i)
@@ -115,14 +198,69 @@ class MicrophoneStream:
         self._audio_stream.stop_stream()
         self._audio_stream.close()
         self.closed = True
-        self._buff.put(None)
+        self._buff.append(None)
+        self._event.set()
         self._audio_interface.terminate()
 
     def _fill_buffer(self, in_data, frame_count, time_info, status_flags):
         """Callback-функция для заполнения буфера аудиоданными."""
-        self._buff.put(in_data)
+        if self._device_rate != self._rate:
+            # audioop удален в Python 3.13, поэтому нужен только при пересчете
+            import audioop
+            in_data, self._ratecv_state = audioop.ratecv(
+                in_data, 2, 1, self._device_rate, self._rate, self._ratecv_state
+            )
+        
+        voiced = self._voiced_frames(in_data)
+        now = time.time()
+        if voiced:
+            self._buff.append(voiced)
+        elif now - self._last_sent >= VAD_KEEPALIVE:
+            # Без аудио Google Speech закрывает поток, поэтому изредка шлем тишину.
+            # Эти кадры уже лежат в буфере перед речью, повторно их не отправляем
+            self._buff.append(in_data)
+            self._preroll.clear()
+        else:
+            return None, pyaudio.paContinue
+        
+        self._last_sent = now
+        self._event.set()
         return None, pyaudio.paContinue
 
+    def _voiced_frames(self, in_data):
+        """
+        Отбор кадров с речью.
+        
+        Кадры без речи откладываются в короткий буфер, чтобы не обрезать
+        начало фразы, а после окончания речи еще VAD_HANGOVER_FRAMES кадров
+        отправляются, чтобы распознавание увидело конец фразы.
+        
+        Args:
+            in_data (bytes): Аудиоданные с частотой self._rate
+        
+        Returns:
+            bytes: Кадры для отправки в распознавание (может быть пусто)
+        """
+        data = self._vad_rest + in_data
+        size = self._vad_frame_bytes
+        end = len(data) - len(data) % size
+        self._vad_rest = data[end:]
+        
+        voiced = bytearray()
+        for start in range(0, end, size):
+            frame = data[start:start + size]
+            if self._vad.is_speech(frame, self._rate):
+                self._hangover = VAD_HANGOVER_FRAMES
+                while self._preroll:
+                    voiced.extend(self._preroll.popleft())
+            elif self._hangover:
+                self._hangover -= 1
+            else:
+                self._preroll.append(frame)
+                continue
+            voiced.extend(frame)
+        return bytes(voiced)
+
     def generator(self):
         """
         Генератор аудиоданных из буфера.
@@ -130,59 +268,272 @@ class MicrophoneStream:
         Yields:
             bytes: Блок аудиоданных
         """
+        buf = bytearray()
         while not self.closed:
-            chunk = self._buff.get()
-            if chunk is None:
-                return
-            data = [chunk]
+            self._event.wait()
+            self._event.clear()
             
             # Собираем все доступные чанки
+            while self._buff:
+                chunk = self._buff.popleft()
+                if chunk is None:
+                    return
+                buf.extend(chunk)
+
+            if buf:
+                yield bytes(buf)
+                buf.clear()
+
+class SpeakerStream:
+    """
+    Класс для воспроизведения аудио через aplay.
+    
+    Процесс aplay запускается один раз и получает PCM (S16_LE, моно,
+    TTS_SAMPLE_RATE) через stdin. Так как aplay не сообщает об окончании
+    воспроизведения, момент окончания вычисляется по длительности
+    записанных данных.
+    
+    aplay начинает играть только после заполнения буфера ALSA и держит
+    у себя неполный период, поэтому каждый фрагмент завершается вызовом
+    finish(): тишина длиной в буфер и период проталкивает звук до конца,
+    а ее длительность входит в оценку окончания воспроизведения.
+    """
+    
+    def __init__(self):
+        """Инициализация без запуска aplay."""
+        self._process = None
+        self._playing_until = 0.0  # Время окончания записанного звука
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Запуск процесса aplay."""
+        with self._lock:
+            self._process = subprocess.Popen(APLAY_COMMAND, stdin=subprocess.PIPE)
+            self._playing_until = 0.0
+    
+    def write(self, pcm: bytes, interrupted: threading.Event = None):
+        """
+        Передача PCM в aplay.
+        
+        Проверка interrupted и выбор процесса выполняются под той же
+        блокировкой, что и перезапуск в stop(), поэтому данные прерванного
+        ответа не попадают в новый процесс aplay.
+        
+        Args:
+            pcm (bytes): Аудиоданные S16_LE, моно, TTS_SAMPLE_RATE
+            interrupted (threading.Event): Если установлено, данные отбрасываются
+        """
+        with self._lock:
+            if interrupted is not None and interrupted.is_set():
+                return
+            process = self._process
+            now = time.time()
+            self._playing_until = (
+                max(self._playing_until, now) + len(pcm) / (TTS_SAMPLE_RATE * 2)
+            )
+        
+        # Запись блокируется, пока aplay не освободит место в канале,
+        # поэтому выполняется без блокировки: stop() может прервать ее
+        try:
+            process.stdin.write(pcm)
+            process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            pass  # aplay был остановлен через stop()
+    
+    def finish(self, interrupted: threading.Event = None):
+        """
+        Завершение фрагмента тишиной, чтобы aplay доиграл весь звук.
+        
+        Args:
+            interrupted (threading.Event): Если установлено, тишина не пишется
+        """
+        frames = int(TTS_SAMPLE_RATE * (APLAY_BUFFER_TIME + APLAY_PERIOD_TIME))
+        self.write(bytes(frames * 2), interrupted)
+    
+    def wait(self, interrupted: threading.Event = None):
+        """
+        Ожидание окончания воспроизведения.
+        
+        Args:
+            interrupted (threading.Event): Событие, прерывающее ожидание
+        """
+        while True:
+            remaining = self._playing_until - time.time()
+            if remaining <= 0:
+                return
+            if interrupted is None:
+                time.sleep(remaining)
+            elif interrupted.wait(remaining):
+                return
+    
+    def stop(self):
+        """Немедленная остановка воспроизведения с перезапуском aplay."""
+        with self._lock:
+            process = self._process
+        if process is not None:
+            process.kill()
+            process.wait()
+            try:
+                process.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+        self.start()
+
+_SPEAKER = SpeakerStream()
+
+def to_speaker_pcm(wav_data: bytes) -> bytes:
+    """
+    Преобразование WAV в формат, ожидаемый aplay.
+    
+    Args:
+        wav_data (bytes): Содержимое WAV файла
+    
+    Returns:
+        bytes: PCM S16_LE, моно, TTS_SAMPLE_RATE без заголовка
+    """
+    with wave.open(io.BytesIO(wav_data), 'rb') as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        pcm = wav.readframes(wav.getnframes())
+    
+    if (width, channels, rate) == (2, 1, TTS_SAMPLE_RATE):
+        return pcm
+    
+    # audioop удален в Python 3.13, поэтому нужен только для преобразования
+    import audioop
+    if width != 2:
+        pcm = audioop.lin2lin(pcm, width, 2)
+    if channels == 2:
+        pcm = audioop.tomono(pcm, 2, 0.5, 0.5)
+    if rate != TTS_SAMPLE_RATE:
+        pcm, _ = audioop.ratecv(pcm, 2, 1, rate, TTS_SAMPLE_RATE, None)
+    return pcm
+
+def synthesize(sentence: str) -> bytes:
+    """
+    Синтез одного предложения в речь.
+    
+    Args:
+        sentence (str): Текст предложения
+    
+    Returns:
+        bytes: PCM для воспроизведения через SpeakerStream
+    """
+    response = _TTS_CLIENT.synthesize_speech(
+        input=texttospeech.SynthesisInput(text=sentence),
+        voice=_VOICE,
+        audio_config=_AUDIO_CFG
+    )
+    # LINEAR16 приходит с WAV заголовком, в aplay уходят только отсчеты
+    return to_speaker_pcm(response.audio_content)
+
+def synthesized_sentences(sentences, synthesize):
+    """
+    Синтез предложений по мере их поступления от GPT.
+    
+    Предложения отправляются в пул синтеза из отдельного потока, поэтому
+    синтез и воспроизведение уже готовых предложений идут параллельно
+    с получением ответа от GPT.
+    
+    Args:
+        sentences: Итератор предложений ответа
+        synthesize: Функция синтеза одного предложения
+    
+    Если потребитель прекращает чтение (например, ответ прерван), новые
+    предложения больше не отправляются в синтез, а еще не начатые задачи
+    отменяются, чтобы не занимать пул для следующего ответа.
+    
+    Yields:
+        Результат synthesize для каждого предложения в исходном порядке
+    """
+    futures = queue.Queue()
+    stopped = threading.Event()
+    lock = threading.Lock()  # Проверка stopped и постановка задачи атомарны
+    
+    def submit_all():
+        try:
+            for sentence in sentences:
+                with lock:
+                    if stopped.is_set():
+                        break
+                    print("от GPT получено предложение:", sentence)
+                    futures.put(_TTS_EXECUTOR.submit(synthesize, sentence))
+            if stopped.is_set() and hasattr(sentences, 'close'):
+                sentences.close()  # Закрываем поток ответа GPT
+        except Exception as err:
+            futures.put(err)
+        finally:
+            futures.put(None)
+    
+    threading.Thread(target=submit_all, daemon=True).start()
+    
+    try:
+        while True:
+            item = futures.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item.result()
+    finally:
+        with lock:
+            stopped.set()
             while True:
                 try:
-                    chunk = self._buff.get(block=False)
-                    if chunk is None:
-                        return
-                    data.append(chunk)
+                    item = futures.get_nowait()
                 except queue.Empty:
                     break
+                if item is not None and not isinstance(item, Exception):
+                    item.cancel()
 
-            yield b"".join(data)
+def prefetched_sentences(message: str, prefetched):
+    """
+    Предложения заранее полученного ответа GPT.
+    
+    Ответ сохраняется в историю только здесь, когда итоговый текст
+    совпал с промежуточным. При ошибке упреждающего запроса ответ
+    запрашивается заново.
+    
+    Args:
+        message (str): Итоговый текст запроса
+        prefetched: Future с ответом draft() для этого текста
+    
+    Yields:
+        str: Очередное предложение ответа
+    """
+    try:
+        response_text = prefetched.result()
+    except Exception as err:
+        print(f"Ошибка упреждающего запроса: {err}")
+        yield from ask_stream(111, message)
+        return
+    
+    print("Использован заранее полученный ответ")
+    remember(111, message, response_text)
+    yield from split_sentences(response_text)
 
-def text_message(message: str):
+def text_message(message: str, prefetched=None):
     """
     Обработка текстового сообщения.
     
-    1. Отправляет сообщение в GPT
-    2. Преобразует ответ в речь
-    3. Воспроизводит аудиоответ
+    1. Отправляет сообщение в GPT и получает ответ по предложениям
+    2. Преобразует предложения в речь (LINEAR16) параллельно
+    3. Воспроизводит готовые предложения по порядку, не дожидаясь
+       синтеза остальных
+    
+    Воспроизведение прекращается, если пользователь перебил ответ
+    (см. interrupt_response). Микрофон выключен на все время ответа,
+    чтобы колонка не распознавала сама себя, поэтому перебить можно
+    только фразой, распознавание которой уже шло к началу ответа.
     
     Args:
         message (str): Текст для обработки
+        prefetched: Future с заранее полученным ответом для message или None
     """
+    _BARGE_IN.clear()
     try:
         print("в GPT отправился следующий текст:", message)
-        response = ask(111, message)
-        print("от GPT получен ответ:", response)
-
-        # Синтез речи
-        tts_client = texttospeech.TextToSpeechClient()
-        input_text = texttospeech.SynthesisInput(text=response)
-        
-        voice = texttospeech.VoiceSelectionParams(
-            language_code=LANGUAGE_CODE,
-            name='ru-RU-Wavenet-D',
-            ssml_gender=texttospeech.SsmlVoiceGender.MALE
-        )
-        
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
-        )
-
-        response = tts_client.synthesize_speech(
-            input=input_text,
-            voice=voice,
-            audio_config=audio_config
-        )
 
         # Управление микрофоном
         mixer = alsaaudio.Mixer(control='Mic', cardindex=1)
@@ -190,15 +541,23 @@ def text_message(message: str):
         try:
             mixer.setrec(0)  # Выключаем запись
             
-            # Воспроизведение
-            with open(OUTPUT_FILE, "wb") as out_file:
-                out_file.write(response.audio_content)
+            if prefetched is not None:
+                sentences = prefetched_sentences(message, prefetched)
+            else:
+                sentences = ask_stream(111, message)
             
-            pygame.mixer.music.load(OUTPUT_FILE)
-            pygame.mixer.music.play()
+            pcms = synthesized_sentences(sentences, synthesize)
+            try:
+                for pcm in pcms:
+                    if _BARGE_IN.is_set():
+                        print("Ответ прерван пользователем")
+                        break
+                    _SPEAKER.write(pcm, _BARGE_IN)
+            finally:
+                pcms.close()  # Останавливает синтез оставшихся предложений
             
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
+            _SPEAKER.finish(_BARGE_IN)
+            _SPEAKER.wait(_BARGE_IN)
                 
         finally:
             mixer.setrec(1)  # Включаем запись обратно
@@ -211,17 +570,45 @@ def text_message(message: str):
         except:
             pass
 
+def interrupt_response():
+    """
+    Прерывание текущего ответа при новой реплике пользователя.
+    
+    Срабатывает для фраз, распознанных до выключения микрофона
+    в text_message: во время ответа запись выключена.
+    """
+    _BARGE_IN.set()
+    _SPEAKER.stop()
+
+def normalize_transcript(transcript: str) -> str:
+    """
+    Приведение текста распознавания к виду для сравнения.
+    
+    Итоговый текст часто отличается от промежуточного только регистром
+    и знаками препинания в конце, которые добавляет автопунктуация.
+    """
+    return transcript.casefold().strip().rstrip('.,!?;:… ')
+
 def listen_print_loop(responses):
     """
     Обработка потока распознанной речи.
     
     Реализует логику обработки промежуточных и финальных результатов распознавания.
+    Ответы обрабатываются в фоновом потоке, поэтому поток распознавания
+    читается непрерывно, а новая реплика прерывает еще звучащий ответ.
+    Если промежуточный текст не меняется PREFETCH_STABLE_FRAMES раз подряд,
+    ответ GPT запрашивается заранее и используется, если итоговый текст
+    совпадет с ним.
     
     Args:
         responses: Итератор с результатами распознавания от Google Speech
     """
     last_text = ""
     last_time = time.time()
+    pending = None  # Задача обработки последнего ответа
+    last_interim = ""
+    stable_count = 0
+    prefetch = None  # (нормализованный промежуточный текст, Future с ответом draft)
     
     try:
         print("\nНачало прослушивания...")
@@ -239,12 +626,47 @@ def listen_print_loop(responses):
             print(f"Промежуточный текст: {transcript}")
             print(f"is_final: {is_final}")
             
+            if not is_final:
+                if transcript == last_interim:
+                    stable_count += 1
+                else:
+                    last_interim = transcript
+                    stable_count = 1
+                
+                # Упреждающий запрос, только пока не обрабатывается другой ответ
+                if (stable_count >= PREFETCH_STABLE_FRAMES
+                        and len(transcript) >= MIN_TEXT_LENGTH
+                        and (prefetch is None
+                             or prefetch[0] != normalize_transcript(transcript))
+                        and (pending is None or pending.done())):
+                    if prefetch is not None:
+                        prefetch[1].cancel()
+                    print(f"Упреждающий запрос: {transcript}")
+                    prefetch = (
+                        normalize_transcript(transcript),
+                        _PREFETCH_EXECUTOR.submit(draft, 111, transcript)
+                    )
+            
             if is_final:
+                last_interim = ""
+                stable_count = 0
+                prefetched = None
+                if prefetch is not None:
+                    if prefetch[0] == normalize_transcript(transcript):
+                        prefetched = prefetch[1]
+                    else:
+                        prefetch[1].cancel()
+                    prefetch = None
+                
                 current_time = time.time()
                 if current_time - last_time >= PAUSE_TIME:
                     if len(transcript) >= MIN_TEXT_LENGTH and not transcript.isspace():
                         print(f"Отправка текста в обработку: {transcript}")
-                        text_message(transcript)
+                        if pending is not None and not pending.done():
+                            interrupt_response()
+                        pending = _RESPONSE_EXECUTOR.submit(
+                            text_message, transcript, prefetched
+                        )
                         last_text = transcript
                         last_time = current_time
                     else:
@@ -252,7 +674,7 @@ def listen_print_loop(responses):
                 else:
                     print(f"Слишком малое время с последней обработки: {current_time - last_time} сек")
 
-            if re.search(r"\b(exit|quit)\b", transcript, re.I):
+            if _EXIT_RE.search(transcript):
                 print("Завершение работы...")
                 break
                 
@@ -262,29 +684,23 @@ def listen_print_loop(responses):
 def initialize_audio():
     """Инициализация аудио подсистемы."""
     try:
-        pygame.mixer.quit()
-    except:
-        pass
-        
-    try:
-        os.environ['SDL_AUDIODRIVER'] = 'alsa'
-        pygame.mixer.pre_init(44100, -16, 2, 4096)
-        pygame.mixer.init(buffer=4096)
+        _SPEAKER.start()
     except Exception as e:
         print(f"Ошибка инициализации аудио: {e}")
-        pygame.mixer.init()  # Пробуем дефолтные настройки
+        raise
 
 def play_greeting():
     """Воспроизведение приветственного сообщения."""
-    pygame.mixer.music.load("what_do_you_want.wav")
+    with open(GREETING_FILE, 'rb') as file:
+        pcm = to_speaker_pcm(file.read())
     
     try:
         mixer = alsaaudio.Mixer(control='Mic', cardindex=1)
         mixer.setrec(0)
         
-        pygame.mixer.music.play()
-        while pygame.mixer.music.get_busy():
-            time.sleep(0.1)
+        _SPEAKER.write(pcm)
+        _SPEAKER.finish()
+        _SPEAKER.wait()
     finally:
         mixer.setrec(1)
 
@@ -296,12 +712,20 @@ def main():
     2. Воспроизводит приветствие
     3. Запускает цикл распознавания речи
     """
+    # SIGTERM завершает работу штатно, чтобы история GPT успела записаться
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    # Повышение приоритета, чтобы захват звука не прерывался на медленном железе
+    try:
+        os.nice(MIC_NICE)
+    except OSError as e:
+        print(f"Не удалось повысить приоритет процесса: {e}")
+    
     # Инициализация
     initialize_audio()
     play_greeting()
     
     # Настройка распознавания речи
-    client = speech.SpeechClient()
     config = speech.RecognitionConfig(
         encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
         sample_rate_hertz=RATE,
@@ -318,14 +742,14 @@ def main():
     )
 
     # Запуск цикла распознавания
-    with MicrophoneStream(RATE, CHUNK) as stream:
+    with MicrophoneStream(RATE, CHUNK, MIC_RATE) as stream:
         audio_generator = stream.generator()
         requests = (
             speech.StreamingRecognizeRequest(audio_content=content)
             for content in audio_generator
         )
 
-        responses = client.streaming_recognize(streaming_config, requests)
+        responses = _SPEECH_CLIENT.streaming_recognize(streaming_config, requests)
         listen_print_loop(responses)
 
 if __name__ == "__main__":